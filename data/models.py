@@ -1,45 +1,206 @@
 import sqlite3
 from sqlite3 import Error
+from contextlib import contextmanager
 import time
-from datetime import datetime
+import json
+import asyncio
+import queue
+import threading
+import numpy as np
 from okx import MarketData  # Импортируем класс для получения рыночных данных
+from okx.websocket.WsPublicAsync import WsPublicAsync
 from config import config  # Импортируем конфигурацию
 
+# Лимит SQLite на число параметров в одном запросе (SQLITE_MAX_VARIABLE_NUMBER)
+SQLITE_MAX_VARIABLES = 999
+
+# WebSocket-эндпоинты OKX для канала свечей (flag '0' - реальная торговля, '1' - демо)
+WS_BUSINESS_URLS = {
+    '0': "wss://ws.okx.com:8443/ws/v5/business",
+    '1': "wss://wspap.okx.com:8443/ws/v5/business?brokerId=9999",
+}
+WS_RECONNECT_DELAY = 5
+
+# Фоновая запись сигналов: размер пачки и максимальное ожидание ее накопления (с)
+WRITE_BATCH_SIZE = 100
+WRITE_BATCH_TIMEOUT = 0.5
+
 class Database:
     def __init__(self, db_file):
         """Инициализация базы данных."""
         self.connection = self.create_connection(db_file)
+        # Соединение общее для потоков: транзакции не должны пересекаться
+        self._lock = threading.RLock()
         self.create_table()
         self.create_strategy_signals_table()  # Добавьте этот вызов
+        self.create_state_table()
+        
+        # Единственный поток-писатель сигналов: торговый цикл не ждет коммитов.
+        # Запускается при первом enqueue_signal
+        self._write_q = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
 
     def create_connection(self, db_file):
         """Создание соединения с SQLite базой данных."""
         try:
-            conn = sqlite3.connect(db_file)
+            # isolation_level=None: транзакции управляются явно через BEGIN/COMMIT;
+            # cached_statements: подготовленные запросы (в т.ч. пачки разного размера) переиспользуются
+            conn = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False,
+                                   cached_statements=256)
+            # WAL + synchronous=NORMAL: меньше fsync на коммит, читатели не блокируют писателя
+            conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+                PRAGMA cache_size=-65536;
+            """)
             print(f"Соединение с {db_file} успешно установлено.")
             return conn
         except Error as e:
             print(f"Ошибка '{e}' при создании соединения с {db_file}.")
             return None
 
+    @contextmanager
+    def transaction(self):
+        """Явная транзакция записи (BEGIN IMMEDIATE ... COMMIT / ROLLBACK)."""
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.connection.execute("COMMIT")
+
+    def _writer_loop(self):
+        """
+        Фоновая запись сигналов из очереди.
+        
+        Сигналы собираются в пачку до WRITE_BATCH_SIZE строк или WRITE_BATCH_TIMEOUT 
+        секунд и записываются одной транзакцией. None в очереди - сигнал остановки.
+        """
+        stop = False
+        while not stop:
+            try:
+                row = self._write_q.get(timeout=WRITE_BATCH_TIMEOUT)
+            except queue.Empty:
+                continue
+            
+            batch = []
+            deadline = time.monotonic() + WRITE_BATCH_TIMEOUT
+            while True:
+                if row is None:
+                    stop = True
+                    break
+                batch.append(row)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= WRITE_BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    row = self._write_q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            
+            if batch:
+                self._write_signals_batch(batch)
+
+    def _write_signals_batch(self, batch):
+        """
+        Запись пачки сигналов одной транзакцией.
+        
+        Если пачка не записалась, сигналы записываются по одному, 
+        чтобы ошибочная строка не отбрасывала остальные.
+        
+        :param batch: Список кортежей (symbol, timestamp, signal)
+        """
+        try:
+            self.insert_signals_bulk(batch)
+            return
+        except Error as e:
+            print(f"Ошибка '{e}' при записи {len(batch)} сигналов, запись по одному.")
+        
+        for row in batch:
+            try:
+                self.insert_signal(*row)
+            except Error as e:
+                print(f"Ошибка '{e}' при записи сигнала {row}.")
+
+    def enqueue_signal(self, symbol, timestamp, signal):
+        """Постановка сигнала в очередь фоновой записи (без ожидания коммита)."""
+        with self._writer_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("База данных закрыта: запись сигналов невозможна.")
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+                self._writer.start()
+        self._write_q.put_nowait((symbol, timestamp, signal))
+
+    def close(self):
+        """Запись оставшихся сигналов и закрытие соединения."""
+        with self._writer_lock:
+            self._closed = True
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._write_q.put(None)
+            writer.join()
+        self.connection.close()
+
+    def _rebuild_table(self, table, sql_create_table, columns):
+        """
+        Пересоздание таблицы по новой схеме с переносом данных.
+        
+        :param table: Имя таблицы
+        :param sql_create_table: DDL новой схемы (CREATE TABLE IF NOT EXISTS ...)
+        :param columns: Список колонок, переносимых из старой таблицы
+        """
+        column_list = ", ".join(columns)
+        with self.transaction() as conn:
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            conn.execute(sql_create_table)
+            conn.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {table}_old")
+            conn.execute(f"DROP TABLE {table}_old")
+        print(f"Таблица '{table}' перестроена по новой схеме.")
+
+    def _is_legacy_rowid_table(self, table):
+        """Проверка, что таблица существует и создана без WITHOUT ROWID."""
+        row = self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        return row is not None and 'WITHOUT ROWID' not in row[0].upper()
+
     def create_table(self):
         """Создание таблицы для хранения исторических данных."""
         try:
+            # datetime - вычисляемая колонка: не хранится и не форматируется при записи.
+            # Время в UTC (модификатор 'localtime' в вычисляемых колонках недопустим);
+            # при миграции старые строки с локальным временем пересчитываются в UTC
             sql_create_table = """
             CREATE TABLE IF NOT EXISTS historical_data (
                 symbol TEXT NOT NULL,
                 timestamp INTEGER NOT NULL,
-                datetime TEXT NOT NULL,
+                datetime TEXT GENERATED ALWAYS AS (datetime(timestamp / 1000, 'unixepoch')) VIRTUAL,
                 open REAL,
                 high REAL,
                 low REAL,
                 close REAL,
                 volume REAL,
                 PRIMARY KEY (symbol, timestamp)  -- Устанавливаем уникальный ключ
-            );
+            ) WITHOUT ROWID;  -- Первичный ключ и есть хранилище: выборка по символу - последовательное чтение
             """
-            cursor = self.connection.cursor()
-            cursor.execute(sql_create_table)
+            # Миграция старой схемы: rowid-таблица или datetime как обычная колонка
+            # (hidden = 0 в table_xinfo; у вычисляемых колонок hidden = 2 или 3)
+            stored_datetime = self.connection.execute(
+                "SELECT 1 FROM pragma_table_xinfo('historical_data') WHERE name = 'datetime' AND hidden = 0"
+            ).fetchone()
+            if stored_datetime or self._is_legacy_rowid_table('historical_data'):
+                self._rebuild_table('historical_data', sql_create_table,
+                                    ['symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume'])
+            
+            self.connection.execute(sql_create_table)
             print("Таблица 'historical_data' успешно создана.")
         except Error as e:
             print(f"Ошибка '{e}' при создании таблицы.")
@@ -53,57 +214,95 @@ class Database:
                 timestamp INTEGER NOT NULL,
                 signal TEXT NOT NULL,
                 PRIMARY KEY (symbol, timestamp)  -- Устанавливаем уникальный ключ
-            );
+            ) WITHOUT ROWID;
             """
-            cursor = self.connection.cursor()
-            cursor.execute(sql_create_table)
+            if self._is_legacy_rowid_table('strategy_signals'):
+                self._rebuild_table('strategy_signals', sql_create_table,
+                                    ['symbol', 'timestamp', 'signal'])
+            
+            self.connection.execute(sql_create_table)
             print("Таблица 'strategy_signals' успешно создана.")
         except Error as e:
             print(f"Ошибка '{e}' при создании таблицы.")
 
-    def insert_signal(self, timestamp, signal):
+    def create_state_table(self):
+        """Создание таблицы для хранения состояния позиции стратегии."""
+        try:
+            sql_create_table = """
+            CREATE TABLE IF NOT EXISTS state (
+                symbol TEXT PRIMARY KEY,
+                position_size INTEGER,
+                avg_price REAL
+            ) WITHOUT ROWID;
+            """
+            self.connection.execute(sql_create_table)
+            print("Таблица 'state' успешно создана.")
+        except Error as e:
+            print(f"Ошибка '{e}' при создании таблицы.")
+
+    def save_position_state(self, symbol, position_size, avg_price):
+        """Сохранение состояния позиции по символу (вставка или обновление)."""
+        sql_upsert_state = """
+        INSERT INTO state (symbol, position_size, avg_price)
+        VALUES (?, ?, ?)
+        ON CONFLICT(symbol) DO UPDATE SET
+            position_size = excluded.position_size,
+            avg_price = excluded.avg_price;
+        """
+        with self.transaction() as conn:
+            conn.execute(sql_upsert_state, (symbol, position_size, avg_price))
+
+    def load_position_state(self, symbol):
+        """
+        Получение сохраненного состояния позиции.
+        
+        :param symbol: Символ торговой пары
+        :return: Кортеж (position_size, avg_price) или None, если состояния нет
+        """
+        with self._lock:
+            return self.connection.execute(
+                "SELECT position_size, avg_price FROM state WHERE symbol = ?", (symbol,)
+            ).fetchone()
+
+    def insert_signal(self, symbol, timestamp, signal):
         """Вставка сигнала в таблицу strategy_signals."""
         sql_insert_signal = """
-        INSERT OR REPLACE INTO strategy_signals (timestamp, signal)
-        VALUES (?, ?);
+        INSERT OR REPLACE INTO strategy_signals (symbol, timestamp, signal)
+        VALUES (?, ?, ?);
         """
-        cursor = self.connection.cursor()
-        cursor.execute(sql_insert_signal, (timestamp, signal))
-        self.connection.commit()
+        with self.transaction() as conn:
+            conn.execute(sql_insert_signal, (symbol, timestamp, signal))
 
+    def insert_signals_bulk(self, rows):
+        """
+        Массовая вставка сигналов одной транзакцией.
+        
+        :param rows: Список кортежей (symbol, timestamp, signal)
+        """
+        sql_insert_signal = """
+        INSERT OR REPLACE INTO strategy_signals (symbol, timestamp, signal)
+        VALUES (?, ?, ?);
+        """
+        with self.transaction() as conn:
+            conn.executemany(sql_insert_signal, rows)
 
     def insert_or_update_data(self, symbol, timestamp, open_price, high_price, low_price, close_price, volume):
         """Вставка или обновление данных в таблице."""
-        # Преобразование timestamp в читаемый формат datetime
-        datetime_str = self.convert_timestamp_to_datetime(timestamp)
-        
         sql_insert_or_update = """
         INSERT OR REPLACE INTO historical_data 
-        (symbol, timestamp, datetime, open, high, low, close, volume)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        (symbol, timestamp, open, high, low, close, volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?);
         """
-        cursor = self.connection.cursor()
-        cursor.execute(sql_insert_or_update, (
-            symbol, 
-            timestamp, 
-            datetime_str, 
-            open_price, 
-            high_price, 
-            low_price, 
-            close_price, 
-            volume
-        ))
-        self.connection.commit()
-
-    def convert_timestamp_to_datetime(self, timestamp):
-        """
-        Преобразование timestamp в читаемый формат datetime.
-        
-        :param timestamp: Timestamp в миллисекундах
-        :return: Строка с датой и временем
-        """
-        dt = datetime.fromtimestamp(int(timestamp) / 1000)
-        return dt.strftime('%Y-%m-%d %H:%M:%S')
+        with self.transaction() as conn:
+            conn.execute(sql_insert_or_update, (
+                symbol, 
+                timestamp, 
+                open_price, 
+                high_price, 
+                low_price, 
+                close_price, 
+                volume
+            ))
 
     def bulk_insert_historical_data(self, symbol, historical_candles):
         """
@@ -114,16 +313,23 @@ class Database:
         """
         try:
             # Сортируем свечи по timestamp в порядке возрастания
-            sorted_candles = sorted(historical_candles['data'], key=lambda x: int(x[0]))
+            data = historical_candles['data']
+            ts = np.fromiter((int(c[0]) for c in data), dtype=np.int64, count=len(data))
+            deltas = np.diff(ts)
+            if np.all(deltas >= 0):
+                sorted_candles = data
+            elif np.all(deltas <= 0):
+                # OKX отдает свечи от новых к старым - достаточно развернуть
+                sorted_candles = data[::-1]
+            else:
+                sorted_candles = [data[i] for i in np.argsort(ts, kind='stable')]
             
             data_to_insert = []
             for candle in sorted_candles:
                 timestamp = candle[0]
-                datetime_str = self.convert_timestamp_to_datetime(timestamp)
                 data_to_insert.append((
                     symbol, 
                     timestamp, 
-                    datetime_str, 
                     candle[1],  # open
                     candle[2],  # high
                     candle[3],  # low
@@ -131,15 +337,23 @@ class Database:
                     candle[5]   # volume
                 ))
 
-            sql_bulk_insert = """
-            INSERT OR REPLACE INTO historical_data 
-            (symbol, timestamp, datetime, open, high, low, close, volume)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
-            """
+            # Многострочный INSERT ... VALUES (...),(...): пачками, чтобы не
+            # превысить лимит параметров SQLite
+            columns = "symbol, timestamp, open, high, low, close, volume"
+            n_columns = len(columns.split(","))
+            row_placeholder = "(" + ",".join(["?"] * n_columns) + ")"
+            chunk_size = SQLITE_MAX_VARIABLES // n_columns
             
-            cursor = self.connection.cursor()
-            cursor.executemany(sql_bulk_insert, data_to_insert)
-            self.connection.commit()
+            # Одна транзакция на всю пачку
+            with self.transaction() as conn:
+                for start in range(0, len(data_to_insert), chunk_size):
+                    chunk = data_to_insert[start:start + chunk_size]
+                    placeholders = ",".join([row_placeholder] * len(chunk))
+                    flat_values = tuple(value for row in chunk for value in row)
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO historical_data ({columns}) VALUES {placeholders};",
+                        flat_values
+                    )
             
             print(f"Загружено {len(data_to_insert)} исторических свечей для {symbol}")
         
@@ -154,15 +368,13 @@ class Database:
         :return: Список отсортированных записей
         """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("""
-                SELECT symbol, timestamp, datetime, open, high, low, close, volume 
-                FROM historical_data 
-                WHERE symbol = ? 
-                ORDER BY timestamp ASC
-            """, (symbol,))
-            
-            return cursor.fetchall()
+            with self._lock:
+                return self.connection.execute("""
+                    SELECT symbol, timestamp, datetime, open, high, low, close, volume 
+                    FROM historical_data 
+                    WHERE symbol = ? 
+                    ORDER BY timestamp ASC
+                """, (symbol,)).fetchall()
         
         except Exception as e:
             print(f"Ошибка при получении исторических данных: {e}")
@@ -198,31 +410,59 @@ def fetch_and_store_data(symbol, timeframe='5m', limit=5000):
             # for row in sorted_data:
             #     print(f"{row[1]}\t{row[2]}\t{row[3]}\t{row[4]}\t{row[5]}\t{row[6]}\t{row[7]}")
         
-        # Бесконечный цикл обновления данных каждую секунду
-        while True:
-            # Получаем последнюю свечу
-            latest_candles = market_api.get_candlesticks(symbol, bar=timeframe, limit='1')
-            
-            if latest_candles and 'data' in latest_candles:
-                latest_data = latest_candles['data'][0]
-                
-                # Вставляем или обновляем последнюю свечу
+        # Дальнейшие обновления приходят по WebSocket вместо опроса REST
+        asyncio.run(stream_candles(db, symbol, timeframe))
+
+    except Exception as e:
+        print(f"Ошибка при получении данных: {e}")
+
+async def stream_candles(db, symbol, timeframe='5m'):
+    """
+    Подписка на канал свечей OKX и запись каждого обновления в базу данных.
+    
+    :param db: Экземпляр Database
+    :param symbol: Символ торговой пары
+    :param timeframe: Временной интервал свечей
+    """
+    def on_message(message):
+        # Служебные сообщения (subscribe, error) не содержат поля data
+        for candle in json.loads(message).get('data', []):
+            # Ошибка записи (например, database is locked) не должна рвать подписку
+            try:
                 db.insert_or_update_data(
                     symbol, 
-                    latest_data[0],  # timestamp
-                    latest_data[1],  # open
-                    latest_data[2],  # high
-                    latest_data[3],  # low
-                    latest_data[4],  # close
-                    latest_data[5]   # volume
+                    candle[0],  # timestamp
+                    candle[1],  # open
+                    candle[2],  # high
+                    candle[3],  # low
+                    candle[4],  # close
+                    candle[5]   # volume
                 )
-                # Пример вставки сигнала
+            except Error as e:
+                print(f"Ошибка '{e}' при записи свечи {symbol} {candle[0]}.")
 
-            # Ждем 1 секунду перед следующим обновлением
-            time.sleep(2)
-
-    except Exception as e:
-        print(f"Ошибка при получении данных: {e}")
+    args = [{"channel": f"candle{timeframe}", "instId": symbol}]
+    while True:
+        ws = WsPublicAsync(url=WS_BUSINESS_URLS[config.flag])
+        try:
+            await ws.connect()
+            # WebSocketFactory.connect возвращает None вместо исключения
+            if ws.websocket is None:
+                raise ConnectionError("не удалось установить соединение")
+            await ws.subscribe(args, on_message)
+            # consume завершается при разрыве соединения
+            await ws.consume()
+        except Exception as e:
+            print(f"Ошибка WebSocket-подписки на свечи {symbol}: {e}")
+        finally:
+            # Старое соединение закрывается до переподключения
+            try:
+                await ws.factory.close()
+            except Exception as e:
+                print(f"Ошибка при закрытии WebSocket: {e}")
+        
+        print(f"Переподключение к WebSocket через {WS_RECONNECT_DELAY} с...")
+        await asyncio.sleep(WS_RECONNECT_DELAY)
 
 if __name__ == "__main__":
     fetch_and_store_data('XRP-USDT')
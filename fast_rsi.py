@@ -0,0 +1,54 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Без numba ядро работает как обычная Python-функция
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+
+@njit(cache=True)
+def rsi_incremental(prices, prev_avg_gain, prev_avg_loss, period):
+    """
+    Продолжение RSI по Уайлдеру от сохраненных средних.
+
+    :param prices: Массив цен; prices[0] - цена, на которой посчитаны средние
+    :param prev_avg_gain: Средний прирост на prices[0]
+    :param prev_avg_loss: Средняя потеря на prices[0]
+    :param period: Период RSI
+    :return: Кортеж (rsi для prices[1:], avg_gain, avg_loss)
+    """
+    avg_gain = prev_avg_gain
+    avg_loss = prev_avg_loss
+    rsi = np.empty(len(prices) - 1)
+    for i in range(1, len(prices)):
+        delta = prices[i] - prices[i - 1]
+        avg_gain = (avg_gain * (period - 1) + max(delta, 0.0)) / period
+        avg_loss = (avg_loss * (period - 1) + max(-delta, 0.0)) / period
+        total = avg_gain + avg_loss
+        rsi[i - 1] = 100 * avg_gain / total if total > 0 else 0.0
+    return rsi, avg_gain, avg_loss
+
+
+@njit(cache=True)
+def rsi_seed(prices, period):
+    """
+    Затравка RSI по Уайлдеру (как в talib.RSI): простые средние первых period изменений.
+
+    :param prices: Массив цен; используются первые period + 1 значений
+    :param period: Период RSI
+    :return: Кортеж (rsi на prices[period], avg_gain, avg_loss)
+    """
+    gain_sum = 0.0
+    loss_sum = 0.0
+    for i in range(1, period + 1):
+        delta = prices[i] - prices[i - 1]
+        gain_sum += max(delta, 0.0)
+        loss_sum += max(-delta, 0.0)
+    avg_gain = gain_sum / period
+    avg_loss = loss_sum / period
+    total = avg_gain + avg_loss
+    rsi = 100 * avg_gain / total if total > 0 else 0.0
+    return rsi, avg_gain, avg_loss
@@ -1,9 +1,12 @@
 import time
 import numpy as np
 import talib
+import talib.stream as tas
 import logging
 from okx import Trade, MarketData, Account
 from config import config
+from data.models import Database
+from fast_rsi import rsi_seed, rsi_incremental
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,15 +32,20 @@ class TradingStrategy:
         rsi_oversold (int): Порог перепроданности RSI
     """
 
-    def __init__(self, config_instance=config):
+    def __init__(self, config_instance=config, db=None):
         """
         Инициализация торговой стратегии с настройками конфигурации и подключениями API.
 
         Args:
             config_instance (object, optional): Настройки конфигурации. 
             По умолчанию используется импортированный config.
+            db (Database, optional): База данных для сохранения сигналов. 
+            По умолчанию historical_data.db. Переданную базу закрывает вызывающий код.
         """
         self.config = config_instance
+        # Закрывается в run_strategy только база, созданная самой стратегией
+        self._owns_db = db is None
+        self.db = db if db is not None else Database("historical_data.db")
         
         # Параметры торговли
         self.buy1_size = 40       
@@ -77,10 +85,18 @@ class TradingStrategy:
         # Отслеживание позиции
         self.position_size = 0
         self.position_avg_price = 0
+        self._update_price_levels()
+        
+        # Состояние инкрементального RSI: (timestamp последней закрытой свечи, avg_gain, avg_loss)
+        self._rsi_state = None
+        
+        # Кэш текущей цены: {symbol: (время получения, цена)} и время его жизни в секундах
+        self._price_cache = {}
+        self.price_cache_ttl = 0.5
 
-    def get_historical_prices(self, symbol, limit=100):
+    def get_historical_candles(self, symbol, limit=100):
         """
-        Получение исторических данных о ценах для указанного торгового символа.
+        Получение времени открытия и цен закрытия свечей для указанного торгового символа.
 
         Args:
             symbol (str): Торговый символ (например, 'XRP-USDT')
@@ -88,62 +104,194 @@ class TradingStrategy:
             По умолчанию 100.
 
         Returns:
-            list: Список цен закрытия для указанного символа
+            tuple: (numpy.ndarray timestamp свечей в мс, numpy.ndarray цен закрытия), 
+            от старых к новым
         """
         try:
             candles = self.market_api.get_candlesticks(symbol, bar='5m', limit=str(limit))
-            return [float(candle[5]) for candle in candles['data']]
+            data = candles['data']
+            # OKX возвращает свечи от новых к старым - разворачиваем в хронологический порядок;
+            # цена закрытия - candle[4] (candle[5] - объем)
+            timestamps = np.fromiter((candle[0] for candle in reversed(data)), dtype=np.int64, count=len(data))
+            prices = np.fromiter((candle[4] for candle in reversed(data)), dtype=np.float64, count=len(data))
+            return timestamps, prices
         except Exception as e:
             logger.error(f"Ошибка получения исторических цен: {e}")
-            return []
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    def get_historical_prices(self, symbol, limit=100):
+        """
+        Получение исторических данных о ценах для указанного торгового символа.
+
+        Args:
+            symbol (str): Торговый символ (например, 'XRP-USDT')
+            limit (int, optional): Количество исторических свечей для получения. 
+            По умолчанию 100.
+
+        Returns:
+            numpy.ndarray: Массив цен закрытия для указанного символа (от старых к новым)
+        """
+        return self.get_historical_candles(symbol, limit)[1]
 
     def calculate_rsi(self, prices):
         """
         Расчет индекса относительной силы (RSI) для заданных ценовых данных.
 
         Args:
-            prices (list): Список исторических цен
+            prices (numpy.ndarray): Массив исторических цен
 
         Returns:
             numpy.ndarray: Массив значений RSI
         """
-        return talib.RSI(np.array(prices), timeperiod=self.rsi_length)
+        return talib.RSI(prices, timeperiod=self.rsi_length)
+
+    def calculate_rsi_latest(self, prices):
+        """
+        Расчет только последнего значения RSI через потоковый API TA-Lib 
+        (без выделения массива значений).
+
+        Args:
+            prices (numpy.ndarray): Массив исторических цен
+
+        Returns:
+            float: Последнее значение RSI
+        """
+        rsi = tas.RSI(prices, timeperiod=self.rsi_length)
+        # Новые версии TA-Lib возвращают объект потока, ранние - число
+        return getattr(rsi, 'value', rsi)
+
+    def update_rsi(self, prices, timestamps=None):
+        """
+        Инкрементальный расчет последнего значения RSI.
+
+        Последняя свеча считается формирующейся: средние Уайлдера хранятся 
+        на конец закрытых свечей и обновляются за O(1), пока ряд продолжает 
+        предыдущий (та же свеча обновилась или добавилась одна новая). 
+        Связность ряда определяется по timestamp свечей; без них и для 
+        несвязного ряда состояние пересчитывается полностью.
+
+        Args:
+            prices (list): Список исторических цен (от старых к новым)
+            timestamps (numpy.ndarray, optional): Timestamp свечей, соответствующие prices
+
+        Returns:
+            float: Текущее значение RSI (nan, если данных недостаточно)
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        if len(prices) < self.rsi_length + 2:
+            # Закрытых свечей недостаточно для инкрементального состояния
+            self._rsi_state = None
+            if len(prices) <= self.rsi_length:
+                return np.nan
+            return self.calculate_rsi_latest(prices)
+        
+        n = self.rsi_length
+        closed = prices[:-1]
+        state = self._rsi_state if timestamps is not None else None
+        
+        if state is not None and state[0] == timestamps[-2]:
+            # Обновилась только формирующаяся свеча
+            pass
+        elif state is not None and state[0] == timestamps[-3]:
+            # Закрылась одна свеча - сдвигаем средние на один шаг
+            _, avg_gain, avg_loss = rsi_incremental(closed[-2:], state[1], state[2], n)
+            state = (timestamps[-2], avg_gain, avg_loss)
+        else:
+            # Первый вызов или разрыв ряда - полный пересчет
+            _, avg_gain, avg_loss = rsi_seed(closed, n)
+            _, avg_gain, avg_loss = rsi_incremental(closed[n:], avg_gain, avg_loss, n)
+            state = (timestamps[-2] if timestamps is not None else None, avg_gain, avg_loss)
+        self._rsi_state = state
+        
+        rsi, _, _ = rsi_incremental(prices[-2:], state[1], state[2], n)
+        return float(rsi[0])
 
     def get_current_price(self, symbol):
         """
         Получение текущей цены для указанного торгового символа.
 
+        Цена кэшируется на price_cache_ttl секунд, чтобы повторные вызовы 
+        в пределах одной итерации не обращались к API.
+
         Args:
             symbol (str): Торговый символ (например, 'XRP-USDT')
 
         Returns:
             float: Текущая цена символа
         """
+        cached = self._price_cache.get(symbol)
+        if cached is not None and time.monotonic() - cached[0] < self.price_cache_ttl:
+            return cached[1]
+        
         ticker = self.market_api.get_ticker(symbol)
-        return float(ticker['data'][0]['last'])
+        price = float(ticker['data'][0]['last'])
+        self._price_cache[symbol] = (time.monotonic(), price)
+        return price
 
-    def check_entry_conditions(self, prices, current_price):
+    def _update_price_levels(self):
+        """
+        Пересчет ценовых уровней позиции от средней цены входа.
+
+        Вызывается только при изменении позиции, чтобы проверки условий 
+        в основном цикле сводились к сравнениям.
+        """
+        avg_price = self.position_avg_price
+        self._buy2_price = avg_price * (1 + self.buy2_offset / 100)
+        self._immediate_exit_price = avg_price * (1 - self.immediate_exit_threshold / 100)
+        self._sl_price = avg_price * (1 - self.stop_loss_percent / 100)
+        self._tp_price = avg_price * (1 + self.take_profit_percent / 100)
+
+    def load_position(self, symbol):
+        """
+        Восстановление состояния позиции из базы данных (после перезапуска).
+
+        Args:
+            symbol (str): Торговый символ
+        """
+        state = self.db.load_position_state(symbol)
+        if state is not None:
+            # Размер позиции - целое число контрактов (в старых БД хранился как REAL)
+            self.position_size = int(state[0])
+            self.position_avg_price = state[1]
+            self._update_price_levels()
+            logger.info(f"Восстановлена позиция {symbol}: размер {self.position_size}, "
+                        f"цена {self.position_avg_price}")
+
+    def _save_position(self, symbol):
+        """
+        Сохранение состояния позиции в базу данных.
+
+        Ошибка записи только логируется: ордер к этому моменту уже отправлен.
+
+        Args:
+            symbol (str): Торговый символ
+        """
+        try:
+            self.db.save_position_state(symbol, self.position_size, self.position_avg_price)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния позиции {symbol}: {e}")
+
+    def check_entry_conditions(self, prices, current_price, timestamps=None):
         """
         Проверка условий для входа в позицию.
 
         Args:
             prices (list): Список исторических цен
             current_price (float): Текущая цена
+            timestamps (numpy.ndarray, optional): Timestamp свечей для инкрементального RSI
 
         Returns:
             str или None: Сигнал для входа ('buy1' или 'buy2') или None, 
             если условия входа не выполнены
         """
-        rsi_values = self.calculate_rsi(prices)
-        current_rsi = rsi_values[-1]
+        current_rsi = self.update_rsi(prices, timestamps)
         
         # Условия для первой покупки
         if self.position_size == 0 and current_rsi < self.rsi_oversold:
             return 'buy1'
         
         # Условия для второй покупки
-        if (self.position_size == self.buy1_size and 
-            current_price > self.position_avg_price * (1 + self.buy2_offset / 100)):
+        if self.position_size == self.buy1_size and current_price > self._buy2_price:
             return 'buy2'
         
         return None
@@ -164,19 +312,16 @@ class TradingStrategy:
             return None
         
         # Немедленный выход
-        if current_price < self.position_avg_price * (1 - self.immediate_exit_threshold / 100):
+        if current_price < self._immediate_exit_price:
             return 'immediate_exit'
         
         # Тейк-профит и стоп-лосс
-        stop_loss_price = self.position_avg_price * (1 - self.stop_loss_percent / 100)
-        take_profit_price = self.position_avg_price * (1 + self.take_profit_percent / 100)
-        
-        if current_price <= stop_loss_price or current_price >= take_profit_price:
+        if current_price <= self._sl_price or current_price >= self._tp_price:
             return 'tp_sl'
         
         return None
 
-    def enter_position(self, symbol, side, size):
+    def enter_position(self, symbol, side, size, current_price=None):
         """
         Вход в торговую позицию.
 
@@ -184,12 +329,15 @@ class TradingStrategy:
             symbol (str): Торговый символ
             side (str): Сторона сделки ('buy' или 'sell')
             size (float): Размер позиции
+            current_price (float, optional): Уже полученная текущая цена. 
+            Если не задана, запрашивается через get_current_price.
 
         Returns:
             dict или None: Результат ордера или None в случае ошибки
         """
         try:
-            current_price = self.get_current_price(symbol)
+            if current_price is None:
+                current_price = self.get_current_price(symbol)
             
             order = self.trade_api.place_order(
                 instId=symbol,
@@ -202,6 +350,8 @@ class TradingStrategy:
             # Обновление состояния позиции
             self.position_size += size
             self.position_avg_price = current_price
+            self._update_price_levels()
+            self._save_position(symbol)
             
             logger.info(f"Вход в позицию {symbol}: {side}, размер {size}, цена {current_price}")
             return order
@@ -233,6 +383,8 @@ class TradingStrategy:
             # Сброс состояния позиции
             self.position_size = 0
             self.position_avg_price = 0
+            self._update_price_levels()
+            self._save_position(symbol)
             
             logger.info(f"Выход из позиции {symbol}")
             return order
@@ -240,6 +392,20 @@ class TradingStrategy:
             logger.error(f"Ошибка выхода из позиции: {e}")
             return None
 
+    def record_signal(self, symbol, signal):
+        """
+        Сохранение сигнала стратегии с привязкой к текущей 5-минутной свече.
+
+        Запись выполняется фоновым потоком базы данных.
+
+        Args:
+            symbol (str): Торговый символ
+            signal (str): Сигнал ('buy' или 'sell')
+        """
+        candle_ms = 5 * 60 * 1000
+        timestamp = int(time.time() * 1000) // candle_ms * candle_ms
+        self.db.enqueue_signal(symbol, timestamp, signal)
+
     def run_strategy(self, symbol):
         """
         Основной метод выполнения торговой стратегии.
@@ -250,31 +416,42 @@ class TradingStrategy:
         Args:
             symbol (str): Торговый символ для выполнения стратегии
         """
-        while True:
-            try:
-                # Получение исторических цен и текущей цены
-                historical_prices = self.get_historical_prices(symbol)
-                current_price = self.get_current_price(symbol)
-                
-                # Проверка условий входа
-                entry_signal = self.check_entry_conditions(historical_prices, current_price)
-                
-                if entry_signal == 'buy1':
-                    self.enter_position(symbol, 'buy', self.buy1_size)
-                elif entry_signal == 'buy2':
-                    self.enter_position(symbol, 'buy', self.buy2_size)
-                
-                # Проверка условий выхода
-                exit_signal = self.check_exit_conditions(historical_prices, current_price)
-                
-                if exit_signal in ['immediate_exit', 'tp_sl']:
-                    self.exit_position(symbol)
+        self.load_position(symbol)
+        
+        try:
+            while True:
+                try:
+                    # Получение исторических цен и текущей цены
+                    candle_timestamps, historical_prices = self.get_historical_candles(symbol)
+                    current_price = self.get_current_price(symbol)
+                    
+                    # Проверка условий входа
+                    entry_signal = self.check_entry_conditions(historical_prices, current_price, candle_timestamps)
+                    
+                    order = None
+                    if entry_signal == 'buy1':
+                        order = self.enter_position(symbol, 'buy', self.buy1_size, current_price)
+                    elif entry_signal == 'buy2':
+                        order = self.enter_position(symbol, 'buy', self.buy2_size, current_price)
+                    if order is not None:
+                        self.record_signal(symbol, 'buy')
+                    
+                    # Проверка условий выхода
+                    exit_signal = self.check_exit_conditions(historical_prices, current_price)
+                    
+                    if exit_signal in ['immediate_exit', 'tp_sl']:
+                        if self.exit_position(symbol) is not None:
+                            self.record_signal(symbol, 'sell')
+                    
+                except Exception as e:
+                    logger.error(f"Ошибка в основном цикле стратегии: {e}")
                 
-            except Exception as e:
-                logger.error(f"Ошибка в основном цикле стратегии: {e}")
-            
-            # Пауза перед следующей итерацией
-            time.sleep(10)  # 1 минута
+                # Пауза перед следующей итерацией
+                time.sleep(10)  # 1 минута
+        finally:
+            # Дописываем сигналы из очереди фоновой записи
+            if self._owns_db:
+                self.db.close()
 
 if __name__ == "__main__":
     strategy = TradingStrategy()
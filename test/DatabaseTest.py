@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from data.models import Database
+
+# Схема таблиц до перехода на WITHOUT ROWID и вычисляемую колонку datetime
+BASELINE_SCHEMA = """
+CREATE TABLE historical_data (
+    symbol TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    datetime TEXT NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    volume REAL,
+    PRIMARY KEY (symbol, timestamp)
+);
+CREATE TABLE strategy_signals (
+    symbol TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    signal TEXT NOT NULL,
+    PRIMARY KEY (symbol, timestamp)
+);
+"""
+
+
+class DatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'test.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_baseline_schema_migration(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO historical_data VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [('XRP-USDT', 1700000000000, '2023-11-15 01:13:20', 1.0, 2.0, 0.5, 1.5, 100.0),
+             ('XRP-USDT', 1700000300000, '2023-11-15 01:18:20', 1.5, 2.5, 1.0, 2.0, 200.0)]
+        )
+        conn.executemany(
+            "INSERT INTO strategy_signals VALUES (?, ?, ?)",
+            [('XRP-USDT', 1700000000000, 'buy'), ('XRP-USDT', 1700000300000, 'sell')]
+        )
+        conn.commit()
+        conn.close()
+
+        Database(self.db_path).close()
+
+        for table in ('historical_data', 'strategy_signals'):
+            sql, = self.query(f"SELECT sql FROM sqlite_master WHERE name = '{table}'")[0]
+            self.assertIn('WITHOUT ROWID', sql.upper())
+        self.assertEqual(
+            self.query("SELECT symbol, timestamp, datetime, open, high, low, close, volume "
+                       "FROM historical_data ORDER BY timestamp"),
+            [('XRP-USDT', 1700000000000, '2023-11-14 22:13:20', 1.0, 2.0, 0.5, 1.5, 100.0),
+             ('XRP-USDT', 1700000300000, '2023-11-14 22:18:20', 1.5, 2.5, 1.0, 2.0, 200.0)]
+        )
+        self.assertEqual(
+            self.query("SELECT symbol, timestamp, signal FROM strategy_signals ORDER BY timestamp"),
+            [('XRP-USDT', 1700000000000, 'buy'), ('XRP-USDT', 1700000300000, 'sell')]
+        )
+
+    def test_enqueue_signal_flushed_on_close(self):
+        db = Database(self.db_path)
+        for i in range(250):
+            db.enqueue_signal('XRP-USDT', i, 'buy' if i % 2 else 'sell')
+        db.close()
+
+        self.assertEqual(self.query("SELECT COUNT(*) FROM strategy_signals"), [(250,)])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            db.enqueue_signal('XRP-USDT', 250, 'buy')
+
+
+if __name__ == "__main__":
+    unittest.main()
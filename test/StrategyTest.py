@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import talib
+
+from data.models import Database
+from strategy import TradingStrategy
+from visualization import HistoricalDataVisualizer, RSI_PERIOD
+
+CANDLE_MS = 5 * 60 * 1000
+
+
+def random_prices(n, seed):
+    rng = np.random.default_rng(seed)
+    return 100 + np.cumsum(rng.normal(size=n))
+
+
+class StrategyRSITest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, 'test.db'))
+        self.strategy = TradingStrategy(db=self.db)
+        self.prices = random_prices(80, seed=1)
+        self.timestamps = np.arange(80, dtype=np.int64) * CANDLE_MS
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def assertMatchesTalib(self, prices, timestamps=None):
+        expected = talib.RSI(prices, timeperiod=self.strategy.rsi_length)[-1]
+        self.assertAlmostEqual(self.strategy.update_rsi(prices, timestamps), expected, places=9)
+
+    def test_update_rsi_same_candle_and_one_close(self):
+        for length in range(self.strategy.rsi_length + 1, len(self.prices) + 1):
+            prices = self.prices[:length].copy()
+            timestamps = self.timestamps[:length]
+            # Новая свеча, затем два обновления формирующейся свечи
+            self.assertMatchesTalib(prices, timestamps)
+            for tick in (0.3, -0.7):
+                prices[-1] += tick
+                self.assertMatchesTalib(prices, timestamps)
+
+    def test_update_rsi_gap(self):
+        self.assertMatchesTalib(self.prices[:30], self.timestamps[:30])
+        self.assertMatchesTalib(self.prices[:45], self.timestamps[:45])
+        self.assertMatchesTalib(self.prices[:20], self.timestamps[:20])
+
+    def test_update_rsi_without_timestamps(self):
+        self.assertMatchesTalib(self.prices[:40])
+        self.assertMatchesTalib(self.prices[:41])
+
+    def test_update_rsi_short_series(self):
+        self.assertTrue(np.isnan(self.strategy.update_rsi(self.prices[:self.strategy.rsi_length])))
+
+    def test_update_rsi_flat_market(self):
+        prices = np.ones(30)
+        for length in (20, 21, 30):
+            self.assertEqual(self.strategy.update_rsi(prices[:length], self.timestamps[:length]), 0.0)
+
+
+class VisualizerRSITest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.visualizer = HistoricalDataVisualizer('XRP-USDT', os.path.join(self.tmp.name, 'test.db'))
+        self.prices = random_prices(45, seed=2)
+
+    def tearDown(self):
+        self.visualizer.close()
+        plt.close(self.visualizer.fig)
+        self.tmp.cleanup()
+
+    def assertMatchesTalib(self):
+        expected = talib.RSI(self.visualizer._close, timeperiod=RSI_PERIOD)
+        np.testing.assert_allclose(self.visualizer._rsi, expected, rtol=0, atol=1e-9)
+
+    def test_update_rsi_append_and_update(self):
+        for length in range(1, len(self.prices) + 1):
+            with self.subTest(length=length):
+                # Добавлена свеча
+                self.visualizer._close = self.prices[:length].copy()
+                self.visualizer._update_rsi(length - 1)
+                self.assertMatchesTalib()
+                # Обновлена формирующаяся свеча
+                self.visualizer._close[-1] += 0.2
+                self.visualizer._update_rsi(length - 1)
+                self.assertMatchesTalib()
+
+    def test_update_rsi_full_recalculation(self):
+        self.visualizer._close = self.prices.copy()
+        self.visualizer._update_rsi(0)
+        self.assertMatchesTalib()
+
+
+if __name__ == "__main__":
+    unittest.main()
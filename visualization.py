@@ -1,13 +1,24 @@
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
+from matplotlib.collections import PolyCollection
+import matplotlib.dates as mdates
 import numpy as np
 import sqlite3
-from datetime import datetime
 import threading
 import time
+from datetime import datetime
 from data.models import fetch_and_store_data  # Импортируем функцию загрузки данных
 from config import config  # Импортируем конфигурацию
-import talib
+from fast_rsi import rsi_seed, rsi_incremental
+
+RSI_PERIOD = 14
+# Ширина столбца объема по умолчанию (в днях): одна 5-минутная свеча
+DEFAULT_BAR_WIDTH = 5 / (24 * 60)
+# Сколько последних свечей перечитывается на каждом кадре ради сигналов,
+# закоммиченных фоновым писателем уже после чтения их свечи
+SIGNAL_LOOKBACK_CANDLES = 3
+# Запас по оси объема: рост объема текущей свечи не требует перерисовки каждый кадр
+VOLUME_HEADROOM = 1.25
 
 class HistoricalDataVisualizer:
     def __init__(self, symbol='XRP-USDT', db_path='historical_data.db'):
@@ -20,98 +31,175 @@ class HistoricalDataVisualizer:
         self.symbol = symbol
         self.db_path = db_path
         
+        # Одно соединение на все время работы (данные и сигналы): без повторного
+        # открытия файлов БД/WAL/SHM на каждом кадре; WAL - чтение не блокирует запись
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+        """)
+        
+        # Накопленные данные: timestamp (мс), цена закрытия, объем, RSI
+        self._ts = np.empty(0, dtype=np.int64)
+        self._close = np.empty(0, dtype=np.float64)
+        self._vol = np.empty(0, dtype=np.float64)
+        self._rsi = np.empty(0, dtype=np.float64)
+        # Средние Уайлдера на предпоследней (закрытой) свече: (индекс, avg_gain, avg_loss)
+        self._rsi_state = None
+        # Сигналы стратегии: {timestamp (мс): (цена закрытия свечи, сигнал)}
+        self._signals = {}
+        
         # Настройки графика
         plt.style.use('default')
-        self.fig, (self.ax1, self.ax2, self.ax3) = plt.subplots(3, 1, figsize=(15, 10), 
+        # Общая ось времени: пределы по X задаются один раз для всех трех графиков
+        self.fig, (self.ax1, self.ax2, self.ax3) = plt.subplots(3, 1, figsize=(15, 10), sharex=True,
                                                                   gridspec_kw={'height_ratios': [3, 1, 1]})
         self.fig.suptitle(f'Исторические данные {symbol}', fontsize=16)
         
         # Линии для графика цены
         self.line_close, = self.ax1.plot([], [], label='Close Price', color='white')
         
+        # Маркеры сигналов стратегии
+        self.line_buy, = self.ax1.plot([], [], 'g^', markersize=10, label='Buy Signal')
+        self.line_sell, = self.ax1.plot([], [], 'rv', markersize=10, label='Sell Signal')
+        
         # Линии для объема
-        self.volume_bars = self.ax2.bar([], [], color='blue', alpha=0.5)
+        # Одна коллекция прямоугольников вместо отдельного артиста на каждый столбец
+        self.volume_bars = PolyCollection([], facecolors='blue', alpha=0.5)
+        self.ax2.add_collection(self.volume_bars)
+        self.ax2.xaxis_date()
+        
+        # Текущие пределы осей: фон перерисовывается только при их изменении
+        self._limits = None
         
         # Линии для RSI
         self.line_rsi, = self.ax3.plot([], [], label='RSI', color='orange')
         
         # Настройка осей
-        self.ax1.set_xlabel('Время')
         self.ax1.set_ylabel('Цена')
         self.ax1.grid(True)
+        self.ax1.margins(x=0)
         
-        self.ax2.set_xlabel('Время')
         self.ax2.set_ylabel('Объем')
         self.ax2.grid(True)
         
         self.ax3.set_xlabel('Время')
+        # Метки времени в локальном часовом поясе (timestamps хранятся в UTC)
+        local_tz = datetime.now().astimezone().tzinfo
+        locator = mdates.AutoDateLocator(tz=local_tz)
+        self.ax3.xaxis.set_major_locator(locator)
+        self.ax3.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator, tz=local_tz))
         self.ax3.set_ylabel('RSI')
         self.ax3.axhline(70, color='red', linestyle='--', label='Overbought')
         self.ax3.axhline(30, color='green', linestyle='--', label='Oversold')
+        self.ax3.set_ylim(0, 100)
         self.ax3.grid(True)
         
         # Добавление легенды
-        self.ax1.legend()
+        self.ax1.legend(loc='upper left')
         self.ax3.legend()
 
-    def get_historical_data(self):
+    def close(self):
+        """Закрытие соединения с базой данных."""
+        conn = getattr(self, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.conn = None
+
+    def __del__(self):
+        self.close()
+
+    def _update_rsi(self, start):
         """
-        Получение исторических данных из базы данных.
+        Пересчет RSI начиная с индекса start.
+        
+        Если сохранены средние Уайлдера на свече start - 1, пересчитывается 
+        только хвост, иначе - весь ряд.
         
-        :return: Кортеж с массивами timestamps, close price, volume и rsi
+        :param start: Индекс первой новой или обновленной свечи
         """
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(f"""
-                SELECT timestamp, close, volume 
-                FROM historical_data 
-                WHERE symbol = '{self.symbol}' 
-                ORDER BY timestamp ASC
-            """)
-            
-            data = cursor.fetchall()
-            conn.close()
-            
-            timestamps = [datetime.fromtimestamp(int(row[0])/1000) for row in data]
-            close_prices = [row[1] for row in data]
-            volumes = [row[2] for row in data]
-            
-            # Расчет RSI
-            rsi = talib.RSI(np.array(close_prices), timeperiod=14)
-            
-            return timestamps, close_prices, volumes, rsi
+        n = len(self._close)
+        if n <= RSI_PERIOD:
+            self._rsi = np.full(n, np.nan)
+            self._rsi_state = None
+            return
         
-        except Exception as e:
-            print(f"Ошибка при получении данных: {e}")
-            return [], [], [], []
+        if self._rsi_state is not None and self._rsi_state[0] == start - 1:
+            _, avg_gain, avg_loss = self._rsi_state
+            head = self._rsi[:start]
+        else:
+            seed_rsi, avg_gain, avg_loss = rsi_seed(self._close, RSI_PERIOD)
+            head = np.full(RSI_PERIOD + 1, np.nan)
+            head[-1] = seed_rsi
+            start = RSI_PERIOD + 1
+            if n == start:
+                # Есть только затравка на формирующейся свече - состояние не сохраняем
+                self._rsi = head
+                self._rsi_state = None
+                return
+        
+        # До предпоследней свечи, чтобы сохранить состояние для следующего кадра
+        closed_rsi, avg_gain, avg_loss = rsi_incremental(self._close[start - 1:n - 1], avg_gain, avg_loss, RSI_PERIOD)
+        self._rsi_state = (n - 2, avg_gain, avg_loss)
+        last_rsi, _, _ = rsi_incremental(self._close[n - 2:], avg_gain, avg_loss, RSI_PERIOD)
+        self._rsi = np.concatenate((head, closed_rsi, last_rsi))
 
-    def get_signals(self):
+    def get_historical_data(self):
         """
-        Получение сигналов стратегии из базы данных.
+        Получение исторических данных и сигналов стратегии из базы данных.
+        
+        Свечи и сигналы читаются одним запросом (LEFT JOIN по первичному ключу). 
+        Запрашиваются только последние SIGNAL_LOOKBACK_CANDLES уже загруженных свечей 
+        (ради запоздавших сигналов) и новые строки; в накопленных массивах заменяется 
+        последняя свеча (она могла обновиться) и дописываются новые.
         
-        :return: Список сигналов
+        :return: Кортеж с массивами timestamps, close price, volume, rsi 
+                 и списком сигналов (timestamp, цена, сигнал)
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            last_seen = int(self._ts[-1]) if len(self._ts) else -1
+            window_start = int(self._ts[-SIGNAL_LOOKBACK_CANDLES:][0]) if len(self._ts) else -1
+            data = self.conn.execute("""
+                SELECT h.timestamp, h.close, h.volume, s.signal 
+                FROM historical_data h 
+                LEFT JOIN strategy_signals s 
+                    ON s.symbol = h.symbol AND s.timestamp = h.timestamp 
+                WHERE h.symbol = ? AND h.timestamp >= ?
+                ORDER BY h.timestamp ASC
+            """, (self.symbol, window_start)).fetchall()
             
-            cursor.execute(f"""
-                SELECT timestamp, signal 
-                FROM strategy_signals 
-                WHERE symbol = '{self.symbol}' 
-                ORDER BY timestamp ASC
-            """)
+            for timestamp, close, _, signal in data:
+                if signal is not None:
+                    self._signals[timestamp] = (close, signal)
             
-            signals = cursor.fetchall()
-            conn.close()
+            # Свечи до последней загруженной уже есть в массивах
+            data = [row for row in data if row[0] >= last_seen]
+            if data:
+                new_ts = np.fromiter((row[0] for row in data), dtype=np.int64, count=len(data))
+                new_close = np.fromiter((row[1] for row in data), dtype=np.float64, count=len(data))
+                new_vol = np.fromiter((row[2] for row in data), dtype=np.float64, count=len(data))
+                
+                # Первая строка - повторно прочитанная последняя свеча: заменяем ее
+                keep = len(self._ts)
+                if keep and new_ts[0] == self._ts[-1]:
+                    keep -= 1
+                
+                self._ts = np.concatenate((self._ts[:keep], new_ts))
+                self._close = np.concatenate((self._close[:keep], new_close))
+                self._vol = np.concatenate((self._vol[:keep], new_vol))
+                
+                # Расчет RSI
+                self._update_rsi(keep)
             
-            return [(datetime.fromtimestamp(int(row[0])/1000), row[1]) for row in signals]
+            timestamps = self._ts.astype('datetime64[ms]')
+            signals = [(np.datetime64(timestamp, 'ms'), close, signal)
+                       for timestamp, (close, signal) in self._signals.items()]
+            return timestamps, self._close, self._vol, self._rsi, signals
         
         except Exception as e:
-            print(f"Ошибка при получении сигналов: {e}")
-            return []
+            print(f"Ошибка при получении данных: {e}")
+            return [], [], [], [], []
 
     def update_plot(self, frame):
         """
@@ -119,41 +207,70 @@ class HistoricalDataVisualizer:
         
         :param frame: Текущий кадр анимации
         """
-        timestamps, close_prices, volumes, rsi = self.get_historical_data()
-        signals = self.get_signals()
+        timestamps, close_prices, volumes, rsi, signals = self.get_historical_data()
 
-        if timestamps:
+        if len(timestamps):
             # Обновление линии закрытия
             self.line_close.set_data(timestamps, close_prices)
-            self.ax1.set_xlim(timestamps[0], timestamps[-1])
-            self.ax1.set_ylim(min(close_prices) * 0.95, max(close_prices) * 1.05)
 
-            # Обновление объемов
-            self.volume_bars.remove()
-            self.volume_bars = self.ax2.bar(timestamps, volumes, color='blue', alpha=0.5)
+            # Обновление объемов: вершины всех столбцов одним массивом (N, 4, 2)
+            x = mdates.date2num(timestamps)
+            width = 0.8 * (np.median(np.diff(x)) if len(x) > 1 else DEFAULT_BAR_WIDTH)
+            left, right = x - width / 2, x + width / 2
+            zeros = np.zeros_like(x)
+            self.volume_bars.set_verts(np.stack((
+                np.column_stack((left, zeros)),
+                np.column_stack((left, volumes)),
+                np.column_stack((right, volumes)),
+                np.column_stack((right, zeros)),
+            ), axis=1))
 
             # Обновление RSI
             self.line_rsi.set_data(timestamps, rsi)
-            self.ax3.set_xlim(timestamps[0], timestamps[-1])
-            self.ax3.set_ylim(0, 100)
+
+            # При blit оси и подписи входят в кэшированный фон, поэтому
+            # при изменении пределов фигура перерисовывается целиком
+            limits = (timestamps[0], timestamps[-1], close_prices.min(), close_prices.max())
+            max_volume = volumes.max()
+            redraw = False
+            if limits != self._limits:
+                self._limits = limits
+                self.ax1.relim()
+                self.ax1.autoscale_view(scalex=True, scaley=False)
+                self.ax1.set_ylim(close_prices.min() * 0.95, close_prices.max() * 1.05)
+                self.ax2.set_ylim(0, max_volume * VOLUME_HEADROOM)
+                redraw = True
+            elif max_volume > self.ax2.get_ylim()[1]:
+                # Объем формирующейся свечи растет с каждым тиком: предел по объему
+                # расширяется с запасом, а не на каждом кадре
+                self.ax2.set_ylim(0, max_volume * VOLUME_HEADROOM)
+                redraw = True
+            if redraw:
+                self.fig.canvas.draw()
 
             # Отображение сигналов стратегии
-            for signal_time, signal in signals:
+            buy_x, buy_y, sell_x, sell_y = [], [], [], []
+            for signal_time, price, signal in signals:
                 if signal == 'buy':
-                    self.ax1.plot(signal_time, close_prices[timestamps.index(signal_time)], 'g^', markersize=10, label='Buy Signal')
+                    buy_x.append(signal_time)
+                    buy_y.append(price)
                 elif signal == 'sell':
-                    self.ax1.plot(signal_time, close_prices[timestamps.index(signal_time)], 'rv', markersize=10, label='Sell Signal')
-
-            self.ax1.legend(loc='upper left')
+                    sell_x.append(signal_time)
+                    sell_y.append(price)
+            self.line_buy.set_data(buy_x, buy_y)
+            self.line_sell.set_data(sell_x, sell_y)
 
-        return self.line_close, self.volume_bars, self.line_rsi
+        return self.line_close, self.line_buy, self.line_sell, self.volume_bars, self.line_rsi
 
     def run(self):
         """
         Запуск визуализатора.
         """
-        self.animation = FuncAnimation(self.fig, self.update_plot, interval=1000, blit=False, save_count=100)
-        plt.show()
+        self.animation = FuncAnimation(self.fig, self.update_plot, interval=1000, blit=True, save_count=100)
+        try:
+            plt.show()
+        finally:
+            self.close()
 
 if __name__ == "__main__":
     visualizer = HistoricalDataVisualizer()